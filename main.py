@@ -8,10 +8,14 @@ A flag can be set by the user to add blank page between each pdf file that is me
 Code related to the reportlab library was taken from the following reference:
 https://realpython.com/creating-modifying-pdf/
 """
+import io
+import mmap
 import os
-from pathlib import Path
-from PyPDF2 import PdfReader, PdfWriter, PdfMerger
-from argparse import ArgumentParser
+from collections import deque
+from itertools import accumulate
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject, TextStringObject
+from argparse import ArgumentParser, BooleanOptionalAction
 
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
@@ -19,24 +23,98 @@ from reportlab.lib.units import mm
 from reportlab.lib.colors import grey
 
 
-def create_page_pdf(num: int, tmp: str, text: str):
+def _build_blank_pdf(width: float, height: float):
     """
-    This function creates an empty pdf with only a page number at the bottom and saves
-    the result in tmp
+    Builds the bytes of a minimal pdf with a single empty page, including the cross-reference table
+    :param width: page width in points
+    :param height: page height in points
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] /Resources << >> >>" % (width, height),
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = list()
+    for num, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (num, obj)
+
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+# the blank page is always the same, so its pdf is built once when the module is imported
+BLANK_A4_PDF = _build_blank_pdf(210 * mm, 279 * mm)
+
+# the pdf writer emits many small writes, a large buffer turns them into few large writes to disk
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+FOOTER_FONT = "Times-Roman"
+FOOTER_FONT_SIZE = 11
+
+
+def create_page_pdf(num: int, buf, text: str):
+    """
+    This function creates an empty pdf with only a page number at the bottom and writes
+    the result to buf
     :param num: an integer that determines the number of pages to create in the pdf
-    :param tmp: filename used to save the resulting pdf
+    :param buf: filename or file-like object (e.g. io.BytesIO) used to save the resulting pdf
     :param text: footer text to be added to the bottom of each page
     """
-    c = canvas.Canvas(tmp, pagesize=A4)
+    c = canvas.Canvas(buf, pagesize=A4)
+    # footer text is written to the bottom middle of the page
+    x = (210 // 2) * mm - 20 * mm
+    y = 4 * mm
     for i in range(1, num + 1):
-        c.setFont("Times-Roman", 11)
+        # showPage resets the graphics state, so font and color have to be set on every page
+        c.setFont(FOOTER_FONT, FOOTER_FONT_SIZE)
         c.setFillColor(grey)
-        # writing footer text to the bottom middle of the page
-        c.drawString((210 // 2) * mm - 20 * mm, 4 * mm, text + f" page {i} of {num}")
+        c.drawString(x, y, f"{text} page {i} of {num}")
         c.showPage()
     c.save()
 
 
+def add_bookmarks(writer: PdfWriter, bookmarks: list):
+    """
+    Adds a flat outline with one bookmark per tuple to a writer. The outline items are built and linked to each
+    other directly, which has much less overhead per item than calling writer.add_outline_item for each bookmark.
+    :param writer: the writer to add the bookmarks to, it should not have an outline yet
+    :param bookmarks: list of tuples, each tuple contains the page number and label for a bookmark
+    """
+    if not bookmarks:
+        return
+
+    root = writer.get_outline_root()
+    items = list()
+    refs = list()
+    for p_num, label in bookmarks:
+        item = DictionaryObject({
+            NameObject("/Title"): TextStringObject(label),
+            NameObject("/Parent"): root.indirect_reference,
+            NameObject("/Dest"): ArrayObject([writer.pages[p_num].indirect_reference, NameObject("/Fit")]),
+        })
+        items.append(item)
+        # _add_object is private pypdf API (written against pypdf 4.3), there is no public way to register an
+        # object with the writer and get its indirect reference back
+        refs.append(writer._add_object(item))
+
+    # link each item to its neighbours
+    for i, item in enumerate(items):
+        if i > 0:
+            item[NameObject("/Prev")] = refs[i - 1]
+        if i < len(items) - 1:
+            item[NameObject("/Next")] = refs[i + 1]
+
+    root[NameObject("/First")] = refs[0]
+    root[NameObject("/Last")] = refs[-1]
+    root[NameObject("/Count")] = NumberObject(len(refs))
+
+
 def add_page_numbers(pdf_path: str, new_path: str, text: str, bookmarks: list):
     """
     Add page numbers, a footer and bookmarks to a pdf, saves the result to a new pdf
@@ -45,50 +123,135 @@ def add_page_numbers(pdf_path: str, new_path: str, text: str, bookmarks: list):
     :param text: footer text
     :param bookmarks: list of tuples, each tuple contains the page number and label for a bookmark
     """
-    tmp = "__tmp.pdf"
-
     writer = PdfWriter()
     # 1. Create a reader object for the pdf to which we want to add page numbers
     with open(pdf_path, "rb") as fr:
         reader = PdfReader(fr)
         n = len(reader.pages)
 
-        # 2. create new PDF that contains a footer and page numbers
-        create_page_pdf(n, tmp, text)
+        # 2. create new PDF in memory that contains a footer and page numbers
+        buf = io.BytesIO()
+        create_page_pdf(n, buf, text)
+        buf.seek(0)
 
         # 3. create a second reader for the new PDF
-        with open(tmp, "rb") as ftmp:
-            number_pdf = PdfReader(ftmp)
-            # iterarte pages
-            for p in range(n):
-                # .pages is PageObject represents a single page within a PDF file
-                page = reader.pages[p]
-                number_layer = number_pdf.pages[p]
-                # merge number page with the page containing the footer and page number in one page
-                page.merge_page(number_layer)
-                writer.add_page(page)
+        number_pdf = PdfReader(buf)
+        # .pages is a list-like of PageObjects, each represents a single page within a PDF file
+        reader_pages = reader.pages
+        number_pages = number_pdf.pages
+        # iterarte pages
+        for p in range(n):
+            page = reader_pages[p]
+            number_layer = number_pages[p]
+            # merge number page with the page containing the footer and page number in one page
+            page.merge_page(number_layer)
+            writer.add_page(page)
+
+        add_bookmarks(writer, bookmarks)
+
+        # write result, n is the number of pages added to the writer
+        if n:
+            with open(new_path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+                writer.write(f)
+
+
+def create_blank_page(dst):
+    """
+    Creates a blank pdf page of A4 format and writes it to dst
+    :param dst: file path or file-like object (e.g. io.BytesIO) for the newly created blank pdf
+    """
+    if hasattr(dst, "write"):
+        dst.write(BLANK_A4_PDF)
+    else:
+        with open(dst, "wb") as f:
+            f.write(BLANK_A4_PDF)
+
+
+def _list_pdfs(src_dir: str):
+    """
+    Lists the pdf files in src_dir, sorted by name so the merge order does not depend on the filesystem
+    :param src_dir: directory to scan
+    :returns: a list of os.DirEntry objects
+    """
+    with os.scandir(src_dir) as it:
+        return sorted((e for e in it if e.is_file() and e.name.lower().endswith(".pdf")),
+                      key=lambda e: e.name)
 
-            for p_num, label in bookmarks:
-                writer.add_outline_item(title=label, page_number=p_num)
 
-            # write result
-            if len(writer.pages) > 0:
-                with open(new_path, "wb") as f:
-                    writer.write(f)
-        # remove the pdf that just contains the page numbers
-        # this is just a 'helper pdf'
-        os.remove(tmp)
+def _map_file(path: str):
+    """
+    Memory-maps a file read-only, so a parser can read from it without copying the whole file into memory,
+    and asks the OS to start loading it into the page cache
+    :param path: file path to map
+    :returns: a mmap.mmap object, the caller is responsible for closing it
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # madvise is not available on every platform
+    if hasattr(mmap, "MADV_WILLNEED"):
+        mapped.madvise(mmap.MADV_WILLNEED)
+    return mapped
 
 
-def create_blank_page(dst_pdf_path: str):
+def _prefetch(paths: list, max_prefetch: int = 4):
+    """
+    Maps the next max_prefetch files ahead of the one the caller processes. _map_file asks the OS to start
+    loading each file into the page cache, so their content is already there when they are parsed.
+    :param paths: file paths to map
+    :param max_prefetch: maximum number of files that are mapped ahead
+    :returns: a generator that yields a mmap.mmap object for each file, in the order of paths. The caller
+        closes each yielded mmap, the ones mapped ahead are closed here if the caller stops early.
     """
-    Creates a blank pdf page of A4 format and writes it to disk
-    :param dst_pdf_path: the file path for the newly created blank pdf
+    pending = deque()
+    try:
+        for path in paths:
+            pending.append(_map_file(path))
+            if len(pending) > max_prefetch:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for mapped in pending:
+            mapped.close()
+
+
+def _page_count(path: str):
     """
-    with open(dst_pdf_path, "wb") as f:
-        writer = PdfWriter()
-        writer.add_blank_page(210 * mm, 279 * mm)
-        writer.write(f)
+    Counts the pages of a pdf. The pages are counted from the page tree, the same way they are copied later on,
+    because the /Count entry of the page tree is not always correct.
+    :param path: file path of the pdf
+    """
+    with _map_file(path) as mapped:
+        return len(PdfReader(mapped).pages)
+
+
+def _append_pdfs(writer: PdfWriter, paths: list, with_blank: bool = False):
+    """
+    Appends the pages of the pdfs in paths to a writer
+    :param writer: the writer to add the pages to
+    :param paths: file paths of the pdfs to merge, in merge order
+    :param with_blank: if provided the function will add a blank page after each pdf that is merged
+    :returns: a tuple with a list of tuples with the page number (counted from the first appended page) and label
+        for a bookmark, and the number of pages appended
+    """
+    bookmarks = list()
+    page_count = 0
+    if with_blank:
+        blank_page = PdfReader(io.BytesIO(BLANK_A4_PDF), strict=False).pages[0]
+
+    for path in paths:
+        bookmarks.append((page_count, os.path.basename(path)))
+        with _map_file(path) as mapped:
+            # pages are copied as they are: the content streams are never decoded, only their raw bytes are
+            # written out again, and a non-strict reader tolerates minor defects instead of failing the merge
+            reader = PdfReader(mapped, strict=False)
+            page_count += len(reader.pages)
+            writer.append_pages_from_reader(reader)
+        if with_blank:
+            writer.add_page(blank_page)
+            page_count += 1
+
+    return bookmarks, page_count
 
 
 def merge_pdf_list(src_dir: str, dst_pdf_path: str, with_blank: bool = False):
@@ -105,35 +268,73 @@ def merge_pdf_list(src_dir: str, dst_pdf_path: str, with_blank: bool = False):
     :returns bookmarks: a list of tuples where is tuple contains the page number and label for a bookmark.
     """
 
-    bookmarks = list()
-    input_path = Path(src_dir)
-    merger = PdfMerger()   # instantiate a pdf writer
+    writer = PdfWriter()
+    bookmarks, _ = _append_pdfs(writer, [entry.path for entry in _list_pdfs(src_dir)], with_blank)
 
-    # if with_blank = True create a temporary blank pdf
-    if with_blank:
-        tmp_path = "--tmp.pdf"
-        create_blank_page(tmp_path)
-
-    # go over each pdf in the src_dir and append it to the merger
-    for path in input_path.glob("*.pdf"):
-        # create a list of tuples for the bookmarks:
-        bookmarks.append((len(merger.pages), path.name))
-
-        with open(path, "rb") as f:
-            # the second argument sets a book mark
-            merger.append(f, str(path.name))
-            # if there is a blank_path add a blank page
-            if with_blank:
-                with open(tmp_path, "rb") as fb:
-                    merger.append(fb)
-                    fb.close()
-    # write all pdfs in the merger to dst_pdf_path
-    with open(dst_pdf_path, "wb") as fw:
-        merger.write(fw)
-
-    # delete the blank page to keep a clean working space
+    add_bookmarks(writer, bookmarks)
+
+    # write all pdfs in the writer to dst_pdf_path
+    with open(dst_pdf_path, "wb", buffering=WRITE_BUFFER_SIZE) as fw:
+        writer.write(fw)
+
+    return bookmarks
+
+
+def merge_and_number(src_dir: str, dst_pdf_path: str, text: str, with_blank: bool = False):
+    """
+    merges all pdfs in src_dir to one pdf, adds page numbers, a footer and a bookmark for each merged pdf,
+    and writes the result to dst_pdf_path.
+
+    This does the work of merge_pdf_list followed by add_page_numbers in a single pass, without writing
+    the merged pdf to disk and parsing it again. Every input pdf is still parsed twice: once to count its pages,
+    because the page number pdf has to be created before the first page is merged, and once to copy its pages.
+
+    :param src_dir: source directory that contains the pdfs to merge
+    :param dst_pdf_path: destination file path to save the merged and numbered pdf
+    :param text: footer text
+    :param with_blank: if provided the function will add a blank page between each pdf that is merged
+    :returns bookmarks: a list of tuples where is tuple contains the page number and label for a bookmark.
+    """
+    entries = _list_pdfs(src_dir)
+    paths = [entry.path for entry in entries]
+
+    # 1. count the pages of every pdf to know the size of the page number pdf and the bookmark positions.
+    # each bookmark is at the sum of the page counts of the pdfs before it
+    counts = [_page_count(path) for path in paths]
     if with_blank:
-        os.remove(tmp_path)
+        counts = [count + 1 for count in counts]
+    offsets = list(accumulate(counts, initial=0))
+    bookmarks = list(zip(offsets, (entry.name for entry in entries)))
+    total = offsets[-1]
+
+    # 2. create a PDF in memory that contains a footer and page numbers for all pages
+    buf = io.BytesIO()
+    create_page_pdf(total, buf, text)
+    buf.seek(0)
+    number_pages = PdfReader(buf).pages
+
+    # 3. merge the number page into each page of each pdf and add it to the writer
+    writer = PdfWriter()
+    global_idx = 0
+    for mapped in _prefetch(paths):
+        # the writer holds copies of the pages, so the file can be unmapped once they are added
+        with mapped:
+            reader = PdfReader(mapped)
+            for page in reader.pages:
+                page.merge_page(number_pages[global_idx])
+                writer.add_page(page)
+                global_idx += 1
+        if with_blank:
+            page = writer.add_blank_page(210 * mm, 279 * mm)
+            page.merge_page(number_pages[global_idx])
+            global_idx += 1
+
+    add_bookmarks(writer, bookmarks)
+
+    # write result, total is the number of pages added to the writer
+    if total:
+        with open(dst_pdf_path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+            writer.write(f)
 
     return bookmarks
 
@@ -149,7 +350,7 @@ def parser():
     parser.add_argument("--footer-text", required=True, type=str,
                         help="text that will be added to the bottom of each page")
 
-    parser.add_argument("--add-blank", type=bool, default=True,
+    parser.add_argument("--add-blank", action=BooleanOptionalAction, default=False,
                         help="flag to determine if you want a blank page between each document")
 
     return parser
@@ -162,14 +363,8 @@ if __name__ == "__main__":
     print("[INFO] The following arguments are parsed from the argparse:")
     print(args)
 
-    # merge all pdfs and store in a temporary file
-    tmp_path = "./tmp.pdf"
-    print(f"[INFO] merging all pdf in the directory {args.input_dir} and saving the result to {tmp_path}")
-    bookmarks = merge_pdf_list(args.input_dir, tmp_path, with_blank=args.add_blank)
-
-    # add page numbers and store in user provided location then delete the temporary file
-    print(f"[INFO] numbering the pages and adding bookmarks in the file {tmp_path} and saving to {args.output_path}  ")
-    add_page_numbers(tmp_path, args.output_path, args.footer_text, bookmarks)
-    os.remove(tmp_path)
+    # merge all pdfs, number the pages and add bookmarks in one pass
+    print(f"[INFO] merging and numbering all pdf in the directory {args.input_dir} and saving to {args.output_path}")
+    merge_and_number(args.input_dir, args.output_path, args.footer_text, with_blank=args.add_blank)
 
     print("[INFO] script finished succesfully ...")